@@ -0,0 +1,19 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from app.core.config import get_settings
+
+def configure_logging() -> QueueListener:
+    """Route all log records through a queue so request handlers never block on stdout"""
+    settings = get_settings()
+    
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(settings.log_level.upper())
+    
+    # Flushes records to stdout from a background thread
+    return QueueListener(log_queue, stream_handler, respect_handler_level=True)
\ No newline at end of file
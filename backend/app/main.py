@@ -1,12 +1,37 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from app.core.config import get_settings
+from app.core.log import configure_logging
 from app.database import engine, Base
 from app.routes import game, websocket
+from app.services.ai_service import ai_service
+from app.services.scenario_service import warm_initial_scenarios
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = configure_logging()
+    log_listener.start()
+    
+    # Create database tables
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    
+    await websocket.manager.start(get_settings().redis_url)
+    
+    # Generate opening scenarios in the background so the first game of each theme is instant
+    warmup = asyncio.create_task(warm_initial_scenarios())
+    yield
+    warmup.cancel()
+    await websocket.manager.stop()
+    await game.close_answer_throttle()
+    await ai_service.close()
+    await engine.dispose()
+    log_listener.stop()
 
-app = FastAPI(title="FrightFate API", version="1.0.0")
+app = FastAPI(title="FrightFate API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -1,15 +1,34 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from enum import StrEnum
 from app.database import Base
 
+class Theme(StrEnum):
+    HAUNTED_HOUSE = "haunted_house"
+    ZOMBIE_OUTBREAK = "zombie_outbreak"
+    SLASHER_MOVIE = "slasher_movie"
+    ALIEN_INVASION = "alien_invasion"
+    DEEP_SEA_TERROR = "deep_sea_terror"
+    
+    @classmethod
+    def normalize(cls, value) -> "Theme":
+        """Map free-form theme input onto a known theme, defaulting to the haunted house"""
+        key = str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+        return cls._value2member_map_.get(key, cls.HAUNTED_HOUSE)
+
+class SessionStatus(StrEnum):
+    WAITING = "waiting"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+
 class GameSession(Base):
     __tablename__ = "game_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
     session_code = Column(String(10), unique=True, index=True)
-    theme = Column(String(50), default="haunted_house")
-    status = Column(String(20), default="waiting")  # waiting, in_progress, completed
+    theme = Column(String(50), default=Theme.HAUNTED_HOUSE.value)
+    status = Column(String(20), default=SessionStatus.WAITING.value)  # waiting, in_progress, completed
     current_question = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -18,6 +37,9 @@ class GameSession(Base):
 
 class Player(Base):
     __tablename__ = "players"
+    __table_args__ = (
+        Index("ix_players_session_name", "session_id", "name"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
@@ -32,6 +54,9 @@ class Player(Base):
 
 class Scenario(Base):
     __tablename__ = "scenarios"
+    __table_args__ = (
+        Index("ix_scenarios_theme_qnum", "theme", "question_number"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     theme = Column(String(50), nullable=False)
@@ -42,13 +67,21 @@ class Scenario(Base):
 
 class PlayerAnswer(Base):
     __tablename__ = "player_answers"
+    __table_args__ = (
+        Index("ix_pa_player_qnum", "player_id", "question_number"),
+        Index("ix_pa_player_latest", "player_id", "id"),
+        Index("ix_pa_player_eliminated", "player_id", "is_eliminated"),
+        UniqueConstraint("session_id", "player_id", "question_number", name="uq_pa_session_player_q"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey("game_sessions.id"))
     player_id = Column(Integer, ForeignKey("players.id"))
     question_number = Column(Integer, nullable=False)
     answer_text = Column(Text, nullable=False)
     score = Column(Integer, default=0)
+    is_eliminated = Column(Boolean, default=False, server_default="false", nullable=False)
+    elimination_reason = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     session = relationship("GameSession", back_populates="answers")
@@ -1 +1 @@
-from .game import GameSession, Player, Scenario, PlayerAnswer
\ No newline at end of file
+from .game import GameSession, Player, Scenario, PlayerAnswer, Theme, SessionStatus
\ No newline at end of file
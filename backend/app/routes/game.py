@@ -1,24 +1,77 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
+from cachetools import TTLCache
+from sqlalchemy import bindparam, exists, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload, load_only
+from app.core.config import get_settings
 from app.database import get_db
-from app.models.game import GameSession, Player, Scenario, PlayerAnswer
-from pydantic import BaseModel
-from typing import Optional
-import random
+from app.models.game import GameSession, Player, Scenario, PlayerAnswer, Theme, SessionStatus
+from pydantic import BaseModel, Field
+from typing import Annotated, Optional
+import hashlib
+import math
+import redis.asyncio as redis
+import secrets
 import string
 from app.services.ai_service import ai_service
+from app.services.scenario_service import get_initial_scenario, prefetch_initial_scenario
+from app.routes.websocket import manager
 import asyncio
 from asyncio import timeout
-import json
+import orjson
+import logging
 
 router = APIRouter()
+logger = logging.getLogger("frightfate.game")
+settings = get_settings()
+
+SESSION_CODE_ATTEMPTS = 5
+SESSION_CODE_LENGTH = 6
+SESSION_CODE_ALPHABET = (string.ascii_uppercase + string.digits).encode()
+SESSION_CODE_BYTE_LIMIT = 256 - 256 % len(SESSION_CODE_ALPHABET)
+SESSION_CODE_PATTERN = rf"^[A-Z0-9]{{{SESSION_CODE_LENGTH}}}$"
+
+# Malformed codes are rejected before they cost a database round trip
+SessionCode = Annotated[str, Path(pattern=SESSION_CODE_PATTERN)]
+
+# Built once and reused so every handler shares one compiled statement
+SESSION_BY_CODE = select(GameSession).where(GameSession.session_code == bindparam("session_code"))
+
+# Per-player answer throttling: across workers through Redis when configured, otherwise per worker process
+SUBMIT_ANSWER_INTERVAL_SECONDS = 2
+# Upper bound on holding the lock, should a worker die mid-answer: longer than the slowest answer can take,
+# i.e. scenario generation, analysis and death narrative deadlines plus waiting for a database connection
+SUBMIT_ANSWER_LOCK_SECONDS = math.ceil(
+    2 * settings.scenario_deadline_seconds + settings.analysis_deadline_seconds + settings.db_pool_timeout + 10
+)
+_answers_in_flight = set()
+_recent_answers: TTLCache = TTLCache(maxsize=10000, ttl=SUBMIT_ANSWER_INTERVAL_SECONDS)
+_throttle_redis: Optional[redis.Redis] = redis.from_url(settings.redis_url) if settings.redis_url else None
+# Turn a held lock into the post-answer interval, but only if it is still this request's lock
+RELEASE_ANSWER_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return false
+"""
+_release_answer_lock = _throttle_redis.register_script(RELEASE_ANSWER_LOCK_SCRIPT) if _throttle_redis is not None else None
+
+# Generations left to finish after their request fell back on a timeout
+_background_generations = set()
+
+# Final results per session, keyed by a digest of the standings they were generated from; only fully generated
+# results are kept, here and in the shared cache, so a model outage doesn't pin fallbacks for the hour
+RESULTS_CACHE_SECONDS = 3600
+_results_cache: TTLCache = TTLCache(maxsize=1024, ttl=RESULTS_CACHE_SECONDS)
 
 # Pydantic models for request bodies
 class SubmitAnswerRequest(BaseModel):
-    session_code: str
+    session_code: str = Field(pattern=SESSION_CODE_PATTERN)
     player_id: int
     question_number: int
-    answer_text: str
+    answer_text: str = Field(min_length=1, max_length=2000)
+    scenario_id: Optional[str] = None
 
 class PlayerState(BaseModel):
     player_id: int
@@ -28,26 +81,56 @@ class PlayerState(BaseModel):
 
 def generate_session_code():
     """Generate a unique 6-character session code"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    code = bytearray()
+    while len(code) < SESSION_CODE_LENGTH:
+        for byte in secrets.token_bytes(SESSION_CODE_LENGTH):
+            # Reject bytes past the last full multiple of the alphabet size to avoid modulo bias
+            if byte < SESSION_CODE_BYTE_LIMIT and len(code) < SESSION_CODE_LENGTH:
+                code.append(SESSION_CODE_ALPHABET[byte % len(SESSION_CODE_ALPHABET)])
+    return code.decode()
 
-@router.post("/create-session")
-async def create_session(theme: str = "haunted_house", db: Session = Depends(get_db)):
-    """Create a new game session with dynamic narrative support"""
-    session_code = generate_session_code()
+def outlive_deadline(coro):
+    """Await a generation that keeps running past the request's deadline, so a late result still reaches the cache"""
+    task = asyncio.create_task(coro)
+    _background_generations.add(task)
+    task.add_done_callback(_background_generations.discard)
+    return asyncio.shield(task)
+
+def cacheable(request: Request, response: Response, payload, cache_control: str):
+    """Tag a response body with an ETag and answer 304 if the client already has it"""
+    digest = hashlib.blake2s(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str), digest_size=8).hexdigest()
+    etag = f'"{digest}"'
     
-    # Make sure code is unique
-    while db.query(GameSession).filter(GameSession.session_code == session_code).first():
-        session_code = generate_session_code()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
     
-    session = GameSession(
-        session_code=session_code,
-        theme=theme,
-        status="waiting"
-    )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return payload
+
+@router.post("/create-session")
+async def create_session(theme: str = "haunted_house", db: AsyncSession = Depends(get_db)):
+    """Create a new game session with dynamic narrative support"""
+    # ON CONFLICT DO NOTHING returns no row on a code collision, so retry without aborting the transaction
+    # INSERT ... RETURNING hands back the stored row without a follow-up refresh SELECT
+    for _ in range(SESSION_CODE_ATTEMPTS):
+        session = (await db.execute(
+            pg_insert(GameSession).values(
+                session_code=generate_session_code(),
+                theme=Theme.normalize(theme).value,
+                status=SessionStatus.WAITING.value
+            ).on_conflict_do_nothing(
+                index_elements=[GameSession.session_code]
+            ).returning(GameSession.session_code, GameSession.theme, GameSession.status)
+        )).one_or_none()
+        if session:
+            await db.commit()
+            break
+    else:
+        raise HTTPException(status_code=503, detail="Could not allocate a unique session code")
     
-    db.add(session)
-    db.commit()
-    db.refresh(session)
+    # Players won't ask for the first scenario until the lobby fills, so start loading it now
+    prefetch_initial_scenario(session.theme)
     
     return {
         "session_code": session.session_code,
@@ -56,33 +139,45 @@ async def create_session(theme: str = "haunted_house", db: Session = Depends(get
     }
 
 @router.post("/join-session/{session_code}")
-async def join_session(session_code: str, player_name: str, db: Session = Depends(get_db)):
+async def join_session(session_code: SessionCode, player_name: Annotated[str, Query(min_length=1, max_length=100)], db: AsyncSession = Depends(get_db)):
     """Join an existing game session"""
-    session = db.query(GameSession).filter(GameSession.session_code == session_code).first()
+    session = (await db.execute(
+        SESSION_BY_CODE, {"session_code": session_code}
+    )).scalar_one_or_none()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    if getattr(session, "status", None) != "waiting":
+    if session.status != SessionStatus.WAITING:
         raise HTTPException(status_code=400, detail="Session is not accepting new players")
     
     # Check if player name already exists in this session
-    existing_player = db.query(Player).filter(
-        Player.session_id == session.id,
-        Player.name == player_name
-    ).first()
-    
-    if existing_player:
+    name_taken = (await db.execute(
+        select(exists().where(
+            Player.session_id == session.id,
+            Player.name == player_name
+        ))
+    )).scalar()
+    
+    if name_taken:
         raise HTTPException(status_code=400, detail="Player name already taken in this session")
     
-    player = Player(
-        name=player_name,
-        session_id=session.id
-    )
+    player = (await db.execute(
+        insert(Player).values(
+            name=player_name,
+            session_id=session.id
+        ).returning(Player.id, Player.name)
+    )).one()
+    await db.commit()
+    
+    await manager.publish(session.session_code, {
+        "type": "player_joined",
+        "player_id": player.id,
+        "player_name": player.name
+    })
     
-    db.add(player)
-    db.commit()
-    db.refresh(player)
+    # No-op when the opening scenario is already cached or loading; retries if the load at creation failed or expired
+    prefetch_initial_scenario(session.theme)
     
     return {
         "player_id": player.id,
@@ -91,14 +186,40 @@ async def join_session(session_code: str, player_name: str, db: Session = Depend
     }
 
 @router.get("/session/{session_code}")
-async def get_session(session_code: str, db: Session = Depends(get_db)):
+async def get_session(session_code: SessionCode, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
     """Get session details including players and their elimination status"""
-    session = db.query(GameSession).filter(GameSession.session_code == session_code).first()
+    # Load the session and its players in one joined query
+    session = (await db.execute(
+        select(GameSession).options(
+            joinedload(GameSession.players).load_only(Player.id, Player.name, Player.is_ready)
+        ).where(GameSession.session_code == session_code)
+    )).unique().scalar_one_or_none()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    players = db.query(Player).filter(Player.session_id == session.id).all()
+    players = session.players
+    
+    # Fetch every player's latest answer in one DISTINCT ON query instead of one query per player
+    latest_answers = {}
+    if players:
+        latest_answers = {
+            answer.player_id: answer
+            for answer in (await db.execute(
+                select(PlayerAnswer).options(
+                    load_only(
+                        PlayerAnswer.id,
+                        PlayerAnswer.player_id,
+                        PlayerAnswer.is_eliminated,
+                        PlayerAnswer.elimination_reason
+                    )
+                ).where(
+                    PlayerAnswer.player_id.in_([player.id for player in players])
+                ).distinct(PlayerAnswer.player_id).order_by(
+                    PlayerAnswer.player_id, PlayerAnswer.id.desc()
+                )
+            )).scalars().all()
+        }
     
     # Check for eliminated players
     eliminated_players = []
@@ -106,16 +227,14 @@ async def get_session(session_code: str, db: Session = Depends(get_db)):
     
     for player in players:
         # Check if player has been eliminated (has an elimination record in their latest answer)
-        latest_answer = db.query(PlayerAnswer).filter(
-            PlayerAnswer.player_id == player.id
-        ).order_by(PlayerAnswer.id.desc()).first()
+        latest_answer = latest_answers.get(player.id)
         
-        if latest_answer and hasattr(latest_answer, 'is_eliminated') and getattr(latest_answer, 'is_eliminated', False):
+        if latest_answer and latest_answer.is_eliminated:
             eliminated_players.append({
                 "id": player.id, 
                 "name": player.name, 
                 "is_eliminated": True,
-                "elimination_reason": getattr(latest_answer, 'elimination_reason', 'Unknown')
+                "elimination_reason": latest_answer.elimination_reason or 'Unknown'
             })
         else:
             active_players.append({
@@ -125,7 +244,8 @@ async def get_session(session_code: str, db: Session = Depends(get_db)):
                 "is_eliminated": False
             })
     
-    return {
+    # Lobby clients poll this endpoint; let unchanged state come back as a bodyless 304
+    return cacheable(request, response, {
         "session_code": session.session_code,
         "theme": session.theme,
         "status": session.status,
@@ -133,35 +253,41 @@ async def get_session(session_code: str, db: Session = Depends(get_db)):
         "active_players": active_players,
         "eliminated_players": eliminated_players,
         "total_players": len(players)
-    }
+    }, "private, max-age=2")
 
 @router.get("/scenario/{session_code}/{question_number}")
-async def get_dynamic_scenario(session_code: str, question_number: int, player_id: int, db: Session = Depends(get_db)):
+async def get_dynamic_scenario(session_code: SessionCode, question_number: int, player_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
     """Get a dynamically generated scenario based on player's history"""
-    print(f"🎭 Getting dynamic scenario for player {player_id}, question {question_number}")
+    logger.info("Getting dynamic scenario for player %s, question %s", player_id, question_number)
     
-    session = db.query(GameSession).filter(GameSession.session_code == session_code).first()
+    session = (await db.execute(
+        SESSION_BY_CODE, {"session_code": session_code}
+    )).scalar_one_or_none()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    player = db.query(Player).filter(Player.id == player_id).first()
+    player = (await db.execute(
+        select(Player).where(Player.id == player_id)
+    )).scalar_one_or_none()
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
     
+    theme_value = Theme.normalize(session.theme)
+    
     try:
-        theme_value = str(getattr(session, "theme", "")) or "haunted_house"
-        
         # Set timeout for AI operations
-        async with timeout(30):
+        async with timeout(settings.scenario_deadline_seconds):
             if question_number == 1:
                 # Generate initial scenario
-                print(f"🎬 Generating initial scenario for theme: {theme_value}")
-                scenario = await ai_service.generate_initial_scenario(theme_value)
+                logger.info("Generating initial scenario for theme: %s", theme_value)
+                scenario = await get_initial_scenario(theme_value)
             else:
                 # Get player's previous choices and scenarios
-                previous_answers = db.query(PlayerAnswer).filter(
-                    PlayerAnswer.player_id == player_id
-                ).order_by(PlayerAnswer.question_number).all()
+                previous_answers = (await db.execute(
+                    select(PlayerAnswer).where(
+                        PlayerAnswer.player_id == player_id
+                    ).order_by(PlayerAnswer.question_number)
+                )).scalars().all()
                 
                 player_choices = []
                 for answer in previous_answers:
@@ -177,87 +303,134 @@ async def get_dynamic_scenario(session_code: str, question_number: int, player_i
                 previous_scenarios = []
                 story_context = player_choices[-1].get('story_context', '') if player_choices else ''
                 
-                print(f"🎬 Generating scenario {question_number} based on {len(player_choices)} previous choices")
-                scenario = await ai_service.generate_next_scenario(
+                logger.info("Generating scenario %s based on %d previous choices", question_number, len(player_choices))
+                scenario = await outlive_deadline(ai_service.generate_next_scenario(
                     theme_value, question_number, previous_scenarios, player_choices, story_context
-                )
+                ))
             
             if scenario:
-                print(f"✅ Generated dynamic scenario: {scenario.get('title', 'Unknown')}")
+                logger.info("Generated dynamic scenario: %s", scenario.get("title", "Unknown"))
+                scenario = await ai_service.remember_scenario(scenario)
+                if question_number == 1:
+                    # Opening scenarios are cached per theme, so clients can keep them too
+                    return cacheable(request, response, scenario, "private, max-age=3600")
                 return scenario
             else:
                 raise Exception("Failed to generate scenario")
                 
     except asyncio.TimeoutError:
-        print("⏰ Scenario generation timed out, using fallback")
-        theme_value = str(getattr(session, "theme", "")) if 'session' in locals() and session else "haunted_house"
-        return ai_service._get_fallback_initial_scenario(theme_value)
+        logger.warning("Scenario generation timed out, using fallback")
+        return await ai_service.remember_scenario(ai_service._get_fallback_scenario(theme_value, question_number))
     except Exception as e:
-        print(f"❌ Error generating dynamic scenario: {e}")
-        theme_value = str(getattr(session, "theme", "")) if 'session' in locals() and session else "haunted_house"
-        return ai_service._get_fallback_initial_scenario(theme_value)
+        logger.error("Error generating dynamic scenario: %s", e)
+        return await ai_service.remember_scenario(ai_service._get_fallback_scenario(theme_value, question_number))
 
 @router.post("/submit-answer")
-async def submit_answer(request: SubmitAnswerRequest, db: Session = Depends(get_db)):
+async def submit_answer(request: SubmitAnswerRequest, db: AsyncSession = Depends(get_db)):
     """Submit a player's answer with death check and dynamic story progression"""
-    print(f"🧠 Processing answer for player {request.player_id}, question {request.question_number}")
+    # One answer at a time per player, and not more often than the interval, so a client can't pile up LLM calls
+    submitter = (request.session_code, request.player_id)
+    throttle_key = f"throttle:answer:{request.session_code}:{request.player_id}"
+    if _throttle_redis is not None:
+        lock_token = secrets.token_hex(8)
+        try:
+            # Held while the answer is processed, then left to expire after the interval
+            if not await _throttle_redis.set(throttle_key, lock_token, nx=True, ex=SUBMIT_ANSWER_LOCK_SECONDS):
+                raise HTTPException(status_code=429, detail="Answer already being processed, please wait")
+        except redis.RedisError as e:
+            logger.error("Answer throttle unavailable in Redis, throttling per worker: %s", e)
+        else:
+            try:
+                return await _process_answer(request, db)
+            finally:
+                try:
+                    if not await _release_answer_lock(keys=[throttle_key], args=[lock_token, SUBMIT_ANSWER_INTERVAL_SECONDS]):
+                        logger.warning("Answer throttle for player %s expired before its answer was processed", request.player_id)
+                except redis.RedisError as e:
+                    logger.error("Could not release answer throttle: %s", e)
+    
+    if submitter in _answers_in_flight or submitter in _recent_answers:
+        raise HTTPException(status_code=429, detail="Answer already being processed, please wait")
+    
+    _answers_in_flight.add(submitter)
+    _recent_answers[submitter] = True
+    try:
+        return await _process_answer(request, db)
+    finally:
+        _answers_in_flight.discard(submitter)
+
+async def close_answer_throttle():
+    if _throttle_redis is not None:
+        await _throttle_redis.aclose()
+
+async def _process_answer(request: SubmitAnswerRequest, db: AsyncSession):
+    logger.info("Processing answer for player %s, question %s", request.player_id, request.question_number)
     
     # Verify session and player
-    session = db.query(GameSession).filter(GameSession.session_code == request.session_code).first()
+    session = (await db.execute(
+        SESSION_BY_CODE, {"session_code": request.session_code}
+    )).scalar_one_or_none()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    player = db.query(Player).filter(
-        Player.id == request.player_id,
-        Player.session_id == session.id
-    ).first()
+    player = (await db.execute(
+        select(Player).where(
+            Player.id == request.player_id,
+            Player.session_id == session.id
+        )
+    )).scalar_one_or_none()
     if not player:
         raise HTTPException(status_code=404, detail="Player not found in session")
     
+    # Load the player's answers once; scenario generation, elimination and death analysis all use them
+    previous_answers = (await db.execute(
+        select(PlayerAnswer).where(
+            PlayerAnswer.player_id == request.player_id
+        ).order_by(PlayerAnswer.question_number)
+    )).scalars().all()
+    
     # Check if player is already eliminated
-    latest_answer = db.query(PlayerAnswer).filter(
-        PlayerAnswer.player_id == request.player_id
-    ).order_by(PlayerAnswer.id.desc()).first()
+    latest_answer = max(previous_answers, key=lambda answer: answer.id, default=None)
     
-    if latest_answer and hasattr(latest_answer, 'is_eliminated') and latest_answer.is_eliminated:
+    if latest_answer and latest_answer.is_eliminated:
         raise HTTPException(status_code=400, detail="Player has been eliminated and cannot continue")
     
     # Get current scenario
-    theme_value = str(getattr(session, "theme", "")) or "haunted_house"
+    theme_value = Theme.normalize(session.theme)
     
-    try:
-        async with timeout(20):
-            if request.question_number == 1:
-                scenario = await ai_service.generate_initial_scenario(theme_value)
-            else:
-                # Get player history for dynamic scenario generation
-                previous_answers = db.query(PlayerAnswer).filter(
-                    PlayerAnswer.player_id == request.player_id
-                ).order_by(PlayerAnswer.question_number).all()
-                
-                player_choices = []
-                for answer in previous_answers:
-                    choice_data = {
-                        "question_number": answer.question_number,
-                        "answer_text": answer.answer_text,
-                        "score": answer.score
-                    }
-                    player_choices.append(choice_data)
-                
-                scenario = await ai_service.generate_next_scenario(
-                    theme_value, request.question_number, [], player_choices, ""
-                ) or ai_service._get_fallback_initial_scenario(theme_value)
-    except Exception as e:
-        print(f"Error getting scenario: {e}")
-        scenario = ai_service._get_fallback_initial_scenario(theme_value)
+    # Prefer the exact scenario the player was shown; only regenerate if it is unknown or expired
+    scenario = await ai_service.recall_scenario(request.scenario_id) if request.scenario_id else None
+    
+    if scenario is None:
+        try:
+            async with timeout(settings.scenario_deadline_seconds):
+                if request.question_number == 1:
+                    scenario = await get_initial_scenario(theme_value)
+                else:
+                    # Get player history for dynamic scenario generation
+                    player_choices = []
+                    for answer in previous_answers:
+                        choice_data = {
+                            "question_number": answer.question_number,
+                            "answer_text": answer.answer_text,
+                            "score": answer.score
+                        }
+                        player_choices.append(choice_data)
+                    
+                    scenario = await outlive_deadline(ai_service.generate_next_scenario(
+                        theme_value, request.question_number, [], player_choices, ""
+                    )) or ai_service._get_fallback_scenario(theme_value, request.question_number)
+        except Exception as e:
+            logger.error("Error getting scenario: %s", e)
+            scenario = ai_service._get_fallback_scenario(theme_value, request.question_number)
     
     # Get player's choice history for death analysis
+    # Leave out an earlier answer to this same question, so re-sending it rebuilds the same prompt and hits the analysis cache
+    existing_answer = next((answer for answer in previous_answers if answer.question_number == request.question_number), None)
     player_history = []
-    previous_answers = db.query(PlayerAnswer).filter(
-        PlayerAnswer.player_id == request.player_id
-    ).order_by(PlayerAnswer.question_number).all()
-    
     for answer in previous_answers:
+        if answer is existing_answer:
+            continue
         player_history.append({
             "question_number": answer.question_number,
             "score": answer.score,
@@ -267,13 +440,13 @@ async def submit_answer(request: SubmitAnswerRequest, db: Session = Depends(get_
     # AI Analysis with death check
     analysis_result = None
     try:
-        async with timeout(20):
+        async with timeout(settings.analysis_deadline_seconds):
             analysis_result = await ai_service.analyze_answer_with_death_check(
                 scenario, request.answer_text, player_history
             )
-            print(f"✅ AI analysis complete: score {analysis_result['survival_score']}, death: {analysis_result.get('instant_death', False)}")
+            logger.info("AI analysis complete: score %s, death: %s", analysis_result["survival_score"], analysis_result.get("instant_death", False))
     except Exception as e:
-        print(f"❌ Error analyzing answer: {e}")
+        logger.error("Error analyzing answer: %s", e)
         # Fallback analysis
         analysis_result = ai_service._fallback_death_analysis(
             request.answer_text, 
@@ -285,36 +458,45 @@ async def submit_answer(request: SubmitAnswerRequest, db: Session = Depends(get_
     instant_death = analysis_result.get("instant_death", False)
     score = analysis_result.get("survival_score", 50)
     
-    # Save the answer
-    existing_answer = db.query(PlayerAnswer).filter(
-        PlayerAnswer.session_id == session.id,
-        PlayerAnswer.player_id == request.player_id,
-        PlayerAnswer.question_number == request.question_number
-    ).first()
-    
-    if existing_answer:
-        setattr(existing_answer, "answer_text", request.answer_text)
-        setattr(existing_answer, "score", score)
-        if instant_death:
-            setattr(existing_answer, "is_eliminated", True)
-            setattr(existing_answer, "elimination_reason", analysis_result.get("death_reason", "Poor survival choices"))
-        db.commit()
-    else:
-        answer_data = {
-            "session_id": session.id,
+    # Save the answer (insert, or overwrite a previous answer to the same question, in one statement)
+    answer_data = {
+        "session_id": session.id,
+        "player_id": request.player_id,
+        "question_number": request.question_number,
+        "answer_text": request.answer_text,
+        "score": score
+    }
+    
+    if instant_death:
+        answer_data["is_eliminated"] = True
+        answer_data["elimination_reason"] = analysis_result.get("death_reason", "Poor survival choices")
+    
+    # An unchanged resubmission leaves the stored answer as it is; there is nothing to write or announce
+    unchanged = (
+        existing_answer is not None
+        and existing_answer.answer_text == request.answer_text
+        and existing_answer.score == score
+        and not instant_death
+    )
+    
+    if not unchanged:
+        await db.execute(
+            pg_insert(PlayerAnswer).values(**answer_data).on_conflict_do_update(
+                index_elements=["session_id", "player_id", "question_number"],
+                set_={
+                    key: value for key, value in answer_data.items()
+                    if key not in ("session_id", "player_id", "question_number")
+                }
+            )
+        )
+        await db.commit()
+        
+        await manager.publish(session.session_code, {
+            "type": "answer_submitted",
             "player_id": request.player_id,
             "question_number": request.question_number,
-            "answer_text": request.answer_text,
-            "score": score
-        }
-        
-        if instant_death:
-            answer_data["is_eliminated"] = True
-            answer_data["elimination_reason"] = analysis_result.get("death_reason", "Poor survival choices")
-        
-        answer = PlayerAnswer(**answer_data)
-        db.add(answer)
-        db.commit()
+            "is_eliminated": bool(instant_death)
+        })
     
     response_data = {
         "message": "Answer submitted successfully",
@@ -326,28 +508,31 @@ async def submit_answer(request: SubmitAnswerRequest, db: Session = Depends(get_
     
     # If player died instantly, generate death narrative
     if instant_death:
-        print(f"💀 Player {request.player_id} has been eliminated")
+        logger.info("Player %s has been eliminated", request.player_id)
         
         try:
+            # player_history holds every other question's score; add this question's new score
             player_data = {
                 "player_name": player.name,
-                "total_score": sum(a.score for a in db.query(PlayerAnswer).filter(PlayerAnswer.player_id == request.player_id).all()),
+                "total_score": sum(h["score"] for h in player_history) + score,
                 "answer_count": len(player_history) + 1
             }
             
-            death_narrative = await ai_service.generate_death_narrative(
-                player_data, analysis_result.get("death_reason", "Poor survival choices")
-            )
+            death_reason = analysis_result.get("death_reason", "Poor survival choices")
+            async with timeout(settings.scenario_deadline_seconds):
+                death_narrative = await ai_service.generate_death_narrative(player_data, death_reason)
+            if death_narrative is None:
+                death_narrative = ai_service._fallback_death_narrative(player_data, death_reason)
             
             response_data.update({
                 "instant_death": True,
                 "death_narrative": death_narrative,
                 "game_over": True,
-                "elimination_reason": analysis_result.get("death_reason", "Poor survival choices")
+                "elimination_reason": death_reason
             })
             
         except Exception as e:
-            print(f"❌ Error generating death narrative: {e}")
+            logger.error("Error generating death narrative: %s", e)
             response_data.update({
                 "instant_death": True,
                 "death_narrative": {
@@ -362,20 +547,24 @@ async def submit_answer(request: SubmitAnswerRequest, db: Session = Depends(get_
     return response_data
 
 @router.get("/check-elimination/{session_code}/{player_id}")
-async def check_player_elimination(session_code: str, player_id: int, db: Session = Depends(get_db)):
+async def check_player_elimination(session_code: SessionCode, player_id: int, db: AsyncSession = Depends(get_db)):
     """Check if a player has been eliminated"""
-    session = db.query(GameSession).filter(GameSession.session_code == session_code).first()
+    session = (await db.execute(
+        SESSION_BY_CODE, {"session_code": session_code}
+    )).scalar_one_or_none()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    latest_answer = db.query(PlayerAnswer).filter(
-        PlayerAnswer.player_id == player_id
-    ).order_by(PlayerAnswer.id.desc()).first()
+    latest_answer = (await db.execute(
+        select(PlayerAnswer).where(
+            PlayerAnswer.player_id == player_id
+        ).order_by(PlayerAnswer.id.desc()).limit(1)
+    )).scalar_one_or_none()
     
-    if latest_answer and hasattr(latest_answer, 'is_eliminated') and getattr(latest_answer, 'is_eliminated', False):
+    if latest_answer and latest_answer.is_eliminated:
         return {
             "is_eliminated": True,
-            "elimination_reason": getattr(latest_answer, 'elimination_reason', 'Unknown'),
+            "elimination_reason": latest_answer.elimination_reason or 'Unknown',
             "can_continue": False
         }
     
@@ -385,63 +574,109 @@ async def check_player_elimination(session_code: str, player_id: int, db: Sessio
     }
 
 @router.get("/results/{session_code}")
-async def get_results(session_code: str, db: Session = Depends(get_db)):
+async def get_results(session_code: SessionCode, db: AsyncSession = Depends(get_db)):
     """Get AI-generated final results including eliminated players"""
-    print(f"🏆 Generating results for session: {session_code}")
+    logger.info("Generating results for session: %s", session_code)
     
-    session = db.query(GameSession).filter(GameSession.session_code == session_code).first()
+    session = (await db.execute(
+        SESSION_BY_CODE, {"session_code": session_code}
+    )).scalar_one_or_none()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get all players and their answers
-    players = db.query(Player).filter(Player.session_id == session.id).all()
+    # Aggregate every player's answers in SQL and join each player's latest answer for the elimination flag
+    answer_stats = select(
+        PlayerAnswer.player_id,
+        func.sum(PlayerAnswer.score).label("total_score"),
+        func.count(PlayerAnswer.id).label("answer_count"),
+        func.avg(PlayerAnswer.score).label("average_score"),
+        func.max(PlayerAnswer.id).label("last_answer_id")
+    ).where(PlayerAnswer.session_id == session.id).group_by(PlayerAnswer.player_id).subquery()
+    latest_answer = aliased(PlayerAnswer)
+    total_score = func.coalesce(answer_stats.c.total_score, 0)
+    eliminated = func.coalesce(latest_answer.is_eliminated, False)
+    
+    # Order survivors, then eliminated players, by score in the same query so both lists come back in finishing order
+    rows = (await db.execute(
+        select(
+            Player.name,
+            total_score.label("total_score"),
+            func.coalesce(answer_stats.c.answer_count, 0).label("answer_count"),
+            func.coalesce(answer_stats.c.average_score, 0).label("average_score"),
+            latest_answer.is_eliminated,
+            latest_answer.elimination_reason
+        ).outerjoin(
+            answer_stats, answer_stats.c.player_id == Player.id
+        ).outerjoin(
+            latest_answer, latest_answer.id == answer_stats.c.last_answer_id
+        ).where(Player.session_id == session.id).order_by(eliminated, total_score.desc(), Player.id)
+    )).all()
     
     players_data = []
     eliminated_players_data = []
     
-    for player in players:
-        answers = db.query(PlayerAnswer).filter(PlayerAnswer.player_id == player.id).all()
-        total_score = sum(answer.score for answer in answers)
-        
-        # Check if player was eliminated
-        latest_answer = answers[-1] if answers else None
-        is_eliminated = latest_answer and hasattr(latest_answer, 'is_eliminated') and getattr(latest_answer, 'is_eliminated', False)
+    for row in rows:
+        is_eliminated = bool(row.is_eliminated)
         
         player_data = {
-            "player_name": player.name,
-            "total_score": total_score,
-            "answer_count": len(answers),
-            "average_score": total_score / len(answers) if answers else 0,
+            "player_name": row.name,
+            "total_score": row.total_score,
+            "answer_count": row.answer_count,
+            "average_score": float(row.average_score),
             "is_eliminated": is_eliminated
         }
         
         if is_eliminated:
-            player_data["elimination_reason"] = getattr(latest_answer, 'elimination_reason', 'Poor survival choices')
+            player_data["elimination_reason"] = row.elimination_reason or 'Poor survival choices'
             eliminated_players_data.append(player_data)
         else:
             players_data.append(player_data)
     
-    print(f"📊 Processing results: {len(players_data)} survivors, {len(eliminated_players_data)} eliminated")
+    logger.info("Processing results: %d survivors, %d eliminated", len(players_data), len(eliminated_players_data))
+    
+    # Refreshing the results screen shouldn't pay for the LLM again unless the standings changed
+    standings = orjson.dumps([players_data, eliminated_players_data], option=orjson.OPT_SORT_KEYS, default=str)
+    results_key = f"ai:results:{session_code}:{hashlib.blake2b(standings, digest_size=8).hexdigest()}"
+    cached_results = _results_cache.get(results_key)
+    if cached_results is None:
+        cached_results = await ai_service._shared_get(results_key)
+    if cached_results is not None:
+        _results_cache[results_key] = cached_results
+        return cached_results
     
     # Generate AI results with timeout
     try:
-        async with timeout(25):
-            # Generate results for survivors
-            survivor_results = []
-            if players_data:
-                survivor_results = await ai_service.generate_final_results(players_data)
-            
-            # Generate elimination narratives for eliminated players
-            elimination_results = []
-            for eliminated_player in eliminated_players_data:
-                try:
-                    death_narrative = await ai_service.generate_death_narrative(
+        async with timeout(settings.results_deadline_seconds):
+            # Generate survivor results and elimination narratives concurrently
+            survivor_results, *death_narratives = await asyncio.gather(
+                ai_service.generate_final_results(players_data) if players_data else asyncio.sleep(0, result=[]),
+                *[
+                    ai_service.generate_death_narrative(
                         eliminated_player, 
                         eliminated_player.get('elimination_reason', 'Poor survival choices')
                     )
+                    for eliminated_player in eliminated_players_data
+                ],
+                return_exceptions=True
+            )
+            if isinstance(survivor_results, Exception):
+                raise survivor_results
+            if survivor_results is None:
+                raise Exception("No final results from the model")
+            
+            elimination_results = []
+            generated = True
+            for eliminated_player, death_narrative in zip(eliminated_players_data, death_narratives):
+                if death_narrative is None:
+                    generated = False
+                    elimination_results.append(ai_service._fallback_death_narrative(
+                        eliminated_player, eliminated_player.get('elimination_reason', 'Poor survival choices')
+                    ))
+                elif not isinstance(death_narrative, Exception):
                     elimination_results.append(death_narrative)
-                except Exception as e:
-                    print(f"❌ Error generating elimination narrative: {e}")
+                else:
+                    generated = False
+                    logger.error("Error generating elimination narrative: %s", death_narrative)
                     elimination_results.append({
                         "player_name": eliminated_player["player_name"],
                         "eliminated": True,
@@ -453,20 +688,24 @@ async def get_results(session_code: str, db: Session = Depends(get_db)):
             # Combine results
             all_results = elimination_results + survivor_results
             
-            print(f"✅ Generated results for {len(all_results)} players")
-            return {
+            logger.info("Generated results for %d players", len(all_results))
+            results = {
                 "results": all_results,
                 "survivors": len(survivor_results),
                 "eliminated": len(elimination_results),
                 "total_players": len(all_results)
             }
+            if generated:
+                _results_cache[results_key] = results
+                await ai_service._shared_set(results_key, results, RESULTS_CACHE_SECONDS)
+            return results
             
     except asyncio.TimeoutError:
-        print("⏰ Results generation timed out, using fallback results")
+        logger.warning("Results generation timed out, using fallback results")
         fallback_results = ai_service._fallback_results(players_data + eliminated_players_data)
         return {"results": fallback_results, "survivors": len(players_data), "eliminated": len(eliminated_players_data)}
         
     except Exception as e:
-        print(f"❌ Error generating results: {str(e)}")
+        logger.error("Error generating results: %s", e)
         fallback_results = ai_service._fallback_results(players_data + eliminated_players_data)
         return {"results": fallback_results, "survivors": len(players_data), "eliminated": len(eliminated_players_data)}
\ No newline at end of file
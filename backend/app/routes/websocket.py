@@ -1,32 +1,121 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List, Dict
-import json
+from typing import Any, List, Dict, Optional, Union
+import redis.asyncio as redis
+import asyncio
+import logging
+import orjson
 
 router = APIRouter()
+logger = logging.getLogger("frightfate.websocket")
+
+# Server-side state changes published within this window go out as one message
+BROADCAST_WINDOW_SECONDS = 0.05
+
+# Every worker subscribes to all session channels and delivers to the sockets it holds itself
+REDIS_CHANNEL_PREFIX = "ws:"
+REDIS_RECONNECT_SECONDS = 1
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        self._lock = asyncio.Lock()
+        self._pending_events: Dict[str, List[Dict[str, Any]]] = {}
+        self._flush_tasks = set()
+        self._redis: Optional[redis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, redis_url: str):
+        """Fan messages out through Redis so sockets held by other workers receive them too"""
+        if not redis_url:
+            return
+        self._redis = redis.from_url(redis_url)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        if self._redis:
+            await self._redis.aclose()
 
     async def connect(self, websocket: WebSocket, session_code: str):
         await websocket.accept()
-        if session_code not in self.active_connections:
-            self.active_connections[session_code] = []
-        self.active_connections[session_code].append(websocket)
+        async with self._lock:
+            if session_code not in self.active_connections:
+                self.active_connections[session_code] = []
+            self.active_connections[session_code].append(websocket)
 
     def disconnect(self, websocket: WebSocket, session_code: str):
         if session_code in self.active_connections:
-            self.active_connections[session_code].remove(websocket)
+            if websocket in self.active_connections[session_code]:
+                self.active_connections[session_code].remove(websocket)
             if not self.active_connections[session_code]:
                 del self.active_connections[session_code]
 
-    async def send_to_session(self, message: str, session_code: str):
-        if session_code in self.active_connections:
-            for connection in self.active_connections[session_code]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    pass  # Connection might be closed
+    async def send_to_session(self, message: Union[str, bytes], session_code: str):
+        # Encode once for the whole session instead of once per client
+        payload = message.encode() if isinstance(message, str) else message
+        
+        if self._redis:
+            try:
+                await self._redis.publish(REDIS_CHANNEL_PREFIX + session_code, payload)
+                return
+            except redis.RedisError as e:
+                logger.error("Error publishing to Redis, delivering locally: %s", e)
+        
+        await self._deliver(payload, session_code)
+
+    async def _deliver(self, payload: bytes, session_code: str):
+        connections = list(self.active_connections.get(session_code, []))
+        if not connections:
+            return
+        
+        # Send to everyone at once so one slow client doesn't hold up the rest
+        results = await asyncio.gather(
+            *(connection.send_bytes(payload) for connection in connections),
+            return_exceptions=True
+        )
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                self.disconnect(connection, session_code)  # Connection might be closed
+
+    async def publish(self, session_code: str, event: Dict[str, Any]):
+        """Push a state change to every client in the session so they don't have to poll"""
+        # With Redis the clients may be connected to another worker
+        if not self._redis and session_code not in self.active_connections:
+            return
+        
+        async with self._lock:
+            pending = self._pending_events.get(session_code)
+            if pending is not None:
+                # A flush is already scheduled for this session; ride along with it
+                pending.append(event)
+                return
+            self._pending_events[session_code] = [event]
+        
+        task = asyncio.create_task(self._flush_events(session_code))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_events(self, session_code: str):
+        await asyncio.sleep(BROADCAST_WINDOW_SECONDS)
+        async with self._lock:
+            events = self._pending_events.pop(session_code, [])
+        
+        if events:
+            await self.send_to_session(orjson.dumps({"type": "session_events", "events": events}), session_code)
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.psubscribe(REDIS_CHANNEL_PREFIX + "*")
+                    async for message in pubsub.listen():
+                        if message["type"] == "pmessage":
+                            session_code = message["channel"].decode()[len(REDIS_CHANNEL_PREFIX):]
+                            await self._deliver(message["data"], session_code)
+            except redis.RedisError as e:
+                logger.error("Redis subscription lost, reconnecting: %s", e)
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
 
 manager = ConnectionManager()
 
@@ -36,7 +125,6 @@ async def websocket_endpoint(websocket: WebSocket, session_code: str):
     try:
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
             
             # Broadcast to all clients in this session
             await manager.send_to_session(data, session_code)
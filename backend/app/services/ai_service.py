@@ -1,44 +1,89 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import asyncio
+import copy
+import hashlib
+import httpx
 import json
+import logging
 import re
 import os
+from itertools import islice
 from typing import List, Dict, Any, Optional
+from cachetools import TTLCache
+import numpy as np
+import orjson
+import redis.asyncio as redis
 from app.core.config import get_settings
+from app.models.game import Theme
 
 settings = get_settings()
-
-class AIService:
-    def __init__(self):
-        # Initialize OpenAI client for GitHub Models
-        self.client = OpenAI(
-            base_url="https://models.github.ai/inference",
-            api_key=settings.github_token,
-        )
-        self.model = settings.openai_model
-        
-        # Default generation settings
-        self.default_config = {
-            "temperature": 0.7,
-            "max_tokens": 2048,
-            "top_p": 0.8,
-        }
-    
-    async def generate_initial_scenario(self, theme: str) -> Dict[str, Any]:
-        """Generate the first scenario that establishes the story"""
-        
-        theme_prompts = {
-            "haunted_house": "a cursed Victorian mansion with supernatural entities, moving objects, and dark family secrets",
-            "zombie_outbreak": "a post-apocalyptic world overrun by zombies where survivors must make tough choices",
-            "slasher_movie": "a classic 80s horror movie scenario with a masked killer stalking victims",
-            "alien_invasion": "an extraterrestrial invasion where humanity fights for survival",
-            "deep_sea_terror": "a deep ocean research facility where something ancient has awakened"
-        }
-        
-        theme_description = theme_prompts.get(theme, "a generic horror scenario")
-        
-        prompt = f"""You are a master horror writer creating the opening scenario for "FrightFate: Who Dies First?" - a multiplayer horror game with branching narratives.
-
-Create the FIRST scenario for the theme: {theme_description}
+logger = logging.getLogger("frightfate.ai")
+
+# Part of every scenario cache key and stored with generated scenarios; bump it after changing a scenario prompt
+SCENARIO_PROMPT_VERSION = 1
+
+# Every reply is a single JSON object (lists are wrapped in one), so JSON mode guarantees it parses
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+# Output budget for final results: enough per player for a short narrative, capped for large lobbies
+RESULTS_TOKENS_PER_PLAYER = 300
+RESULTS_MAX_TOKENS = 2048
+
+# Follow-up scenario prompts carry only the latest few choices and scenarios, with answers clipped;
+# the choice pattern still summarises the whole history
+RECENT_HISTORY = 3
+HISTORY_ANSWER_CHARS = 300
+
+# Answers shorter than this give the model nothing to reason about, so keyword scoring handles them
+MIN_ANALYSED_WORDS = 3
+
+# Player fields the final-results prompt needs; anything else in players_data is bookkeeping
+RESULTS_PROMPT_FIELDS = ("player_name", "total_score", "answer_count", "average_score")
+
+# Fallback results text by rank (1 = survivor, 2 = runner-up, 3 = everyone after), and score bands of 30 points
+FALLBACK_NARRATIVES = {
+    1: "Your strategic thinking and careful decision-making kept you alive when others perished. Every choice you made showed wisdom and survival instinct.",
+    2: "You came close to survival, but a few critical mistakes cost you dearly. Your decision-making showed promise but lacked consistency when it mattered most.",
+    3: "Your impulsive decisions and poor risk assessment led to an early demise. In horror scenarios, hesitation and planning often mean the difference between life and death.",
+}
+FALLBACK_SCORE_BANDS = ("poor", "below average", "average")
+
+# Words the fallback analysis scores an answer on when the model is unavailable
+WORD_RE = re.compile(r"[a-z]+")
+RECKLESS_KEYWORDS = frozenset({"run", "charge", "attack", "rush", "fast", "immediately", "grab", "fight", "scream", "panic"})
+CAUTIOUS_KEYWORDS = frozenset({"carefully", "slowly", "quietly", "observe", "listen", "plan", "strategy", "safe", "caution"})
+
+# Near-duplicate answers remembered per analysis context when the semantic cache is enabled
+SEMANTIC_CACHE_ENTRIES = 64
+
+THEME_PROMPTS = {
+    Theme.HAUNTED_HOUSE: "a cursed Victorian mansion with supernatural entities, moving objects, and dark family secrets",
+    Theme.ZOMBIE_OUTBREAK: "a post-apocalyptic world overrun by zombies where survivors must make tough choices",
+    Theme.SLASHER_MOVIE: "a classic 80s horror movie scenario with a masked killer stalking victims",
+    Theme.ALIEN_INVASION: "an extraterrestrial invasion where humanity fights for survival",
+    Theme.DEEP_SEA_TERROR: "a deep ocean research facility where something ancient has awakened"
+}
+
+FALLBACK_INITIAL_SCENARIOS = {
+    Theme.HAUNTED_HOUSE: {
+        "question_number": 1,
+        "title": "The Inheritance",
+        "description": "You've inherited your great aunt's Victorian mansion. As you step inside for the first time, the heavy door slams shut behind you. The key that worked moments ago now refuses to turn. Through dusty windows, you see your car, but the door won't budge. The house feels unnaturally cold, and you hear slow footsteps on the wooden floors above, though you came here alone. What do you do?",
+        "survival_factors": ["logical_thinking", "caution", "investigation"],
+        "story_context": "Trapped in an inherited haunted mansion",
+        "branching_paths": [
+            {"action_type": "cautious", "description": "Carefully investigate your surroundings"},
+            {"action_type": "aggressive", "description": "Force your way out immediately"},
+            {"action_type": "escape", "description": "Look for alternative exits"}
+        ]
+    }
+}
+
+# Fixed instructions go in the system message and only per-call details in the user message,
+# so every call of a kind starts with the same prefix and can reuse the provider's prompt cache
+INITIAL_SCENARIO_SYSTEM = """You are a master horror writer creating branching narrative scenarios. Return only valid JSON without any markdown formatting.
+
+You are creating the opening scenario for "FrightFate: Who Dies First?" - a multiplayer horror game with branching narratives.
 
 Requirements:
 - This is the story opening that establishes the setting and initial danger
@@ -48,70 +93,22 @@ Requirements:
 - Create dramatic tension but leave room for story progression
 
 Return ONLY valid JSON in this exact format:
-{{
+{
     "question_number": 1,
     "title": "Story Opening Title",
     "description": "Detailed scenario description ending with 'What do you do?'",
     "survival_factors": ["logical_thinking", "caution", "investigation"],
     "story_context": "Brief context about the current situation",
     "branching_paths": [
-        {{"action_type": "cautious", "description": "Careful, methodical approach"}},
-        {{"action_type": "aggressive", "description": "Direct, confrontational approach"}},
-        {{"action_type": "escape", "description": "Avoidance or retreat approach"}}
+        {"action_type": "cautious", "description": "Careful, methodical approach"},
+        {"action_type": "aggressive", "description": "Direct, confrontational approach"},
+        {"action_type": "escape", "description": "Avoidance or retreat approach"}
     ]
-}}"""
-
-        try:
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a master horror writer creating branching narrative scenarios. Return only valid JSON without any markdown formatting."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                **self.default_config
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            response_text = self._clean_json_response(response_text)
-            
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                scenario = json.loads(json_text)
-                return scenario
-            
-            raise Exception("No valid JSON found in response")
-            
-        except Exception as e:
-            print(f"❌ Error generating initial scenario: {e}")
-            return self._get_fallback_initial_scenario(theme)
-    
-    async def generate_next_scenario(self, theme: str, question_number: int, previous_scenarios: List[Dict], 
-                                   player_choices: List[Dict], story_context: str) -> Optional[Dict[str, Any]]:
-        """Generate the next scenario based on player's previous choices"""
-        
-        # Analyze the player's choice pattern
-        choice_pattern = self._analyze_choice_pattern(player_choices)
-        
-        prompt = f"""You are a master horror writer creating the next scenario in a branching narrative for "FrightFate: Who Dies First?".
-
-THEME: {theme}
-CURRENT QUESTION: {question_number}
-STORY CONTEXT: {story_context}
-
-PLAYER'S PREVIOUS CHOICES:
-{json.dumps(player_choices, indent=2)}
+}"""
 
-PLAYER'S CHOICE PATTERN: {choice_pattern}
+NEXT_SCENARIO_SYSTEM = """You are a master horror writer creating connected narrative scenarios. Return only valid JSON without any markdown formatting.
 
-PREVIOUS SCENARIOS:
-{json.dumps(previous_scenarios, indent=2)}
+You are creating the next scenario in a branching narrative for "FrightFate: Who Dies First?".
 
 Create the next scenario that:
 1. Directly follows from the consequences of their previous actions
@@ -124,9 +121,9 @@ If the player has made 2+ critically bad decisions (score < 30), make this a pot
 If they've been consistently reckless, put them in immediate mortal danger.
 If they've been cautious, reward them with a manageable but tense situation.
 
-Return ONLY valid JSON:
-{{
-    "question_number": {question_number},
+Return ONLY valid JSON, with question_number set to the CURRENT QUESTION:
+{
+    "question_number": 2,
     "title": "Scenario Title That References Previous Actions",
     "description": "Detailed scenario (150-300 words) that shows consequences of previous choices, ending with 'What do you do?'",
     "survival_factors": ["relevant", "survival", "skills"],
@@ -134,65 +131,15 @@ Return ONLY valid JSON:
     "death_risk_level": "low|medium|high|instant",
     "narrative_consequences": "How their previous choices led to this moment",
     "branching_paths": [
-        {{"action_type": "survival_focused", "description": "Action that prioritizes staying alive"}},
-        {{"action_type": "story_progression", "description": "Action that moves plot forward"}},
-        {{"action_type": "high_risk", "description": "Dangerous but potentially rewarding action"}}
+        {"action_type": "survival_focused", "description": "Action that prioritizes staying alive"},
+        {"action_type": "story_progression", "description": "Action that moves plot forward"},
+        {"action_type": "high_risk", "description": "Dangerous but potentially rewarding action"}
     ]
-}}"""
-
-        try:
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a master horror writer creating connected narrative scenarios. Return only valid JSON without any markdown formatting."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                **self.default_config
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            response_text = self._clean_json_response(response_text)
-            
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                scenario = json.loads(json_text)
-                return scenario
-            
-            return None
-            
-        except Exception as e:
-            print(f"❌ Error generating next scenario: {e}")
-            return None
-    
-    async def analyze_answer_with_death_check(self, scenario: Dict, player_answer: str, 
-                                            player_history: List[Dict]) -> Dict[str, Any]:
-        """Analyze player answer and determine if they should die instantly"""
-        
-        death_risk = scenario.get("death_risk_level", "medium")
-        previous_poor_choices = sum(1 for choice in player_history if choice.get("score", 50) < 30)
-        
-        prompt = f"""You are an expert survival analyst for a horror survival game with branching narratives.
-
-CURRENT SCENARIO: {scenario.get("title", "")}
-SCENARIO DESCRIPTION: {scenario.get("description", "")[:400]}...
-DEATH RISK LEVEL: {death_risk}
-PLAYER'S PREVIOUS POOR CHOICES: {previous_poor_choices}
+}"""
 
-PLAYER RESPONSE: {player_answer}
+ANALYSIS_SYSTEM = """You are an expert survival analyst for branching horror narratives. Return only valid JSON without any markdown formatting.
 
-SURVIVAL FACTORS BEING TESTED: {', '.join(scenario.get("survival_factors", []))}
-
-PLAYER'S CHOICE HISTORY:
-{json.dumps(player_history[-3:], indent=2) if player_history else "No previous choices"}
-
-Analyze their survival chances considering:
+Analyze the player's survival chances considering:
 1. Does their response show they learned from previous mistakes?
 2. Is their choice appropriate for the current danger level?
 3. Do they show logical thinking vs impulsive behavior?
@@ -205,7 +152,7 @@ DEATH CRITERIA:
 - If death_risk_level is "high" and they're reckless: possible instant death
 
 Return ONLY valid JSON:
-{{
+{
   "survival_score": 75,
   "instant_death": false,
   "death_reason": null,
@@ -213,123 +160,436 @@ Return ONLY valid JSON:
   "story_progression": "How this choice affects the ongoing narrative",
   "choice_classification": "cautious|neutral|reckless|deadly",
   "narrative_consequence": "What happens as a direct result of this action"
-}}
+}
 
 Score scale:
 - 0-20: Certain death or extremely poor choices
-- 21-40: Very likely to die, bad decisions  
+- 21-40: Very likely to die, bad decisions
 - 41-60: Average survival chance, mixed decisions
 - 61-80: Good survival chance, smart choices
 - 81-100: Excellent survival chance, brilliant decisions
 
 Set instant_death to true if they should die immediately."""
 
+DEATH_NARRATIVE_SYSTEM = """You are a horror novelist creating elimination narratives. Return only valid JSON without any markdown formatting.
+
+Create a cinematic death narrative for an eliminated player in "FrightFate: Who Dies First?" that:
+1. References their specific poor decisions
+2. Shows the consequences of their choices
+3. Is dramatic but not gratuitously graphic
+4. Explains why they died (recklessness, poor judgment, etc.)
+
+Return ONLY valid JSON, with player_name set to the PLAYER:
+{
+    "player_name": "PlayerName",
+    "eliminated": true,
+    "death_narrative": "Dramatic 2-3 sentence story of their demise",
+    "death_analysis": "1-2 sentences explaining why their choices led to death",
+    "fate_title": "💀 ELIMINATED",
+    "elimination_reason": "Brief reason for elimination"
+}"""
+
+RESULTS_SYSTEM = """You are a horror novelist creating final results. Return only valid JSON without any markdown formatting. Always include ALL required fields.
+
+You are creating the final results for "FrightFate: Who Dies First?" - a horror survival game.
+
+Rules:
+- Highest total_score survives (rank 1)
+- Others die in reverse score order (rank 2, 3, 4...)
+- Create dramatic, personalized narratives based on their decision-making patterns
+
+Return ONLY valid JSON with one entry per player:
+{
+  "results": [
+    {
+      "player_name": "PlayerName",
+      "rank": 1,
+      "survived": true,
+      "fate_title": "🎉 SOLE SURVIVOR",
+      "narrative": "Personalized 2-3 sentence story of how they survived/died based on their total score and decision patterns",
+      "survival_analysis": "1-2 sentences explaining WHY they survived/died based on their score"
+    }
+  ]
+}
+
+IMPORTANT: Always include ALL required fields: player_name, rank, survived, fate_title, narrative, survival_analysis
+
+Make narratives:
+- Cinematic and dramatic
+- Specific to their performance (high scores = smart decisions, low scores = poor choices)
+- Horror-themed but not gratuitously graphic
+- Personalized, not generic
+
+Order by rank (survivor first, then deaths in order)."""
+
+# Each system prompt is the fixed prefix of its calls; a stable key per prompt helps the provider reuse its prefix cache
+PROMPT_CACHE_KEYS = {
+    INITIAL_SCENARIO_SYSTEM: "initial-scenario",
+    NEXT_SCENARIO_SYSTEM: "next-scenario",
+    ANALYSIS_SYSTEM: "analysis",
+    DEATH_NARRATIVE_SYSTEM: "death-narrative",
+    RESULTS_SYSTEM: "results",
+}
+
+class AIService:
+    def __init__(self):
+        # Initialize OpenAI client for GitHub Models
+        # One long-lived connection pool shared by every call, with connections kept warm between turns
+        # HTTP/2 lets concurrent calls share a single TLS connection instead of opening one each
+        self.http_client = DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0)
+        )
+        self.client = AsyncOpenAI(
+            base_url="https://models.github.ai/inference",
+            api_key=settings.github_token,
+            http_client=self.http_client,
+            timeout=httpx.Timeout(settings.ai_request_timeout_seconds, connect=5.0),
+            max_retries=settings.ai_max_retries,
+        )
+        self.model = settings.openai_model
+        
+        # Caps in-flight model calls per worker so a busy server stays under the provider's rate limit
+        self._call_slots = asyncio.Semaphore(settings.ai_max_concurrency)
+        
+        # Default generation settings
+        # Every reply is a single JSON object, so JSON mode keeps replies parseable; _parse_json still unwraps fenced ones
+        # Output budgets are sized to what each reply needs: a 150-300 word scenario with its paths fits in 900 tokens
+        self.default_config = {
+            "temperature": 0.7,
+            "max_tokens": 900,
+            "top_p": 0.8,
+            "response_format": JSON_OBJECT_FORMAT,
+        }
+        self.narrative_config = {**self.default_config, "max_tokens": 300}
+        
+        # Answer analysis wants short, consistent scoring; final results get more room and variety
+        self.analysis_config = {
+            "temperature": 0.3,
+            "max_tokens": 400,
+            "top_p": 0.8,
+            "response_format": JSON_OBJECT_FORMAT,
+        }
+        self.results_config = {
+            "temperature": 0.8,
+            "max_tokens": RESULTS_MAX_TOKENS,
+            "top_p": 0.9,
+            "response_format": JSON_OBJECT_FORMAT,
+        }
+        
+        # Opening scenarios only depend on the theme, so keep one per theme.
+        # Unknown themes share the generic prompt and therefore one entry.
+        # Entries expire so a worker picks up scenarios replaced in the database.
+        self._initial_scenarios: TTLCache = TTLCache(maxsize=64, ttl=6 * 3600)
+        
+        # Scenarios already shown to players, so answers are analysed against exactly what they saw
+        self._issued_scenarios: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+        
+        # Analyses keyed by a hash of the full prompt, so an identical resubmission skips the LLM
+        self._analysis_cache: TTLCache = TTLCache(maxsize=4096, ttl=24 * 3600)
+        
+        # Answer embeddings and their analyses, grouped by everything in the prompt except the answer
+        self._semantic_cache: TTLCache = TTLCache(maxsize=1024, ttl=24 * 3600)
+        
+        # Follow-up scenarios keyed by a hash of the full prompt, so re-requesting the same question skips the LLM
+        self._scenario_cache: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+        
+        # With Redis configured, analyses and follow-up scenarios are also shared between workers and restarts
+        self._shared_cache: Optional[redis.Redis] = redis.from_url(settings.redis_url) if settings.redis_url else None
+    
+    async def close(self) -> None:
+        await self.client.close()
+        if self._shared_cache is not None:
+            await self._shared_cache.aclose()
+    
+    async def _shared_get(self, key: str) -> Optional[Any]:
+        """Look up a model reply cached by any worker; None when missing or Redis is unavailable"""
+        if self._shared_cache is None:
+            return None
+        try:
+            raw = await self._shared_cache.get(key)
+        except redis.RedisError as e:
+            logger.warning("Shared cache lookup failed: %s", e)
+            return None
+        return orjson.loads(raw) if raw else None
+    
+    async def _shared_set(self, key: str, value: Any, ttl: int) -> None:
+        if self._shared_cache is None:
+            return
+        try:
+            await self._shared_cache.set(key, orjson.dumps(value), ex=ttl)
+        except redis.RedisError as e:
+            logger.warning("Shared cache store failed: %s", e)
+    
+    async def warm_up(self) -> None:
+        """Open a connection to the model endpoint so the first real call skips the TLS handshake"""
         try:
-            analysis_config = {
-                "temperature": 0.3,
-                "max_tokens": 512,
-                "top_p": 0.8,
-            }
+            await self.http_client.head(str(self.client.base_url))
+        except Exception as e:
+            logger.warning("Could not pre-connect to the model endpoint: %s", e)
+    
+    async def _call_json(self, system: str, prompt: str, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Run one chat completion in a free call slot and parse its reply; None if it holds no complete JSON object"""
+        kwargs = {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "model": self.model,
+            **config,
+        }
+        async with self._call_slots:
+            response = await self.client.chat.completions.create(**self._with_cache_key(kwargs))
+        
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            # Cut off at max_tokens: whatever parses from it is missing fields, so never let it be used or cached
+            logger.warning("%s reply truncated at max_tokens", PROMPT_CACHE_KEYS.get(system, "model"))
+            return None
+        response_text = choice.message.content or ""
+        logger.debug("%s reply: %d characters", PROMPT_CACHE_KEYS.get(system, "model"), len(response_text))
+        return self._parse_json(response_text.strip())
+    
+    def _with_cache_key(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if settings.prompt_cache_keys:
+            kind = PROMPT_CACHE_KEYS.get(kwargs["messages"][0]["content"])
+            if kind:
+                kwargs["extra_body"] = {"prompt_cache_key": f"frightfate-{kind}-v{SCENARIO_PROMPT_VERSION}"}
+        return kwargs
+    
+    async def remember_scenario(self, scenario: Dict[str, Any]) -> Dict[str, Any]:
+        """Tag a scenario with a content-derived id and keep it for answer analysis"""
+        scenario_id = hashlib.blake2s(orjson.dumps(scenario, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+        self._issued_scenarios[scenario_id] = scenario
+        # The answer may be submitted to another worker, so it has to be able to find the scenario too
+        await self._shared_set(f"ai:issued:{scenario_id}", scenario, 3600)
+        return {**scenario, "scenario_id": scenario_id}
+    
+    async def recall_scenario(self, scenario_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a scenario previously handed out by remember_scenario, on this or any other worker"""
+        scenario = self._issued_scenarios.get(scenario_id)
+        if scenario is None:
+            scenario = await self._shared_get(f"ai:issued:{scenario_id}")
+            if scenario is not None:
+                self._issued_scenarios[scenario_id] = scenario
+        return scenario
+    
+    def cached_initial_scenario(self, theme: str) -> Optional[Dict[str, Any]]:
+        """Return the cached AI-generated opening scenario for a theme, if any"""
+        cached = self._initial_scenarios.get(self._initial_scenario_key(theme))
+        return copy.deepcopy(cached) if cached is not None else None
+    
+    def cache_initial_scenario(self, theme: str, scenario: Dict[str, Any]) -> None:
+        """Seed the opening scenario cache, e.g. from a stored copy"""
+        self._initial_scenarios[self._initial_scenario_key(theme)] = copy.deepcopy(scenario)
+    
+    def _initial_scenario_key(self, theme: str) -> str:
+        return f"{self.model}|v{SCENARIO_PROMPT_VERSION}|{theme if theme in THEME_PROMPTS else ''}"
+    
+    async def generate_initial_scenario(self, theme: str) -> Dict[str, Any]:
+        """Generate the first scenario that establishes the story"""
+        
+        cache_key = self._initial_scenario_key(theme)
+        cached = self._initial_scenarios.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        theme_description = THEME_PROMPTS.get(theme, "a generic horror scenario")
+        
+        prompt = f"""Create the FIRST scenario for the theme: {theme_description}"""
+
+        try:
+            scenario = await self._call_json(INITIAL_SCENARIO_SYSTEM, prompt, self.default_config)
+            if scenario is not None and self._is_valid_scenario(scenario):
+                self._initial_scenarios[cache_key] = scenario
+                return copy.deepcopy(scenario)
             
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert survival analyst for branching horror narratives. Return only valid JSON without any markdown formatting."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                **analysis_config
-            )
+            raise Exception("No valid JSON found in response")
+            
+        except Exception as e:
+            logger.error("Error generating initial scenario: %s", e)
+            return self._get_fallback_initial_scenario(theme)
+    
+    async def generate_next_scenario(self, theme: str, question_number: int, previous_scenarios: List[Dict], 
+                                   player_choices: List[Dict], story_context: str) -> Optional[Dict[str, Any]]:
+        """Generate the next scenario based on player's previous choices"""
+        
+        # Analyze the player's choice pattern
+        choice_pattern = self._analyze_choice_pattern(player_choices)
+        
+        # With no earlier choices there are no consequences to build on, so the templated follow-up is as good
+        if choice_pattern == "new_player":
+            return self._get_fallback_scenario(theme, question_number)
+        recent_choices = [
+            {**choice, "answer_text": str(choice.get("answer_text", ""))[:HISTORY_ANSWER_CHARS]}
+            for choice in player_choices[-RECENT_HISTORY:]
+        ]
+        
+        prompt = f"""THEME: {theme}
+CURRENT QUESTION: {question_number}
+STORY CONTEXT: {story_context}
+
+PLAYER'S PREVIOUS CHOICES:
+{orjson.dumps(recent_choices, option=orjson.OPT_SORT_KEYS).decode()}
+
+PLAYER'S CHOICE PATTERN: {choice_pattern}
+
+PREVIOUS SCENARIOS:
+{orjson.dumps(previous_scenarios[-RECENT_HISTORY:], option=orjson.OPT_SORT_KEYS).decode()}"""
+
+        cache_key = hashlib.blake2b(f"{self.model}|{prompt}".encode(), digest_size=16).hexdigest()
+        cached = self._scenario_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        shared_key = f"ai:scenario:v{SCENARIO_PROMPT_VERSION}:{cache_key}"
+        cached = await self._shared_get(shared_key)
+        if cached is not None:
+            self._scenario_cache[cache_key] = cached
+            return copy.deepcopy(cached)
+
+        try:
+            scenario = await self._call_json(NEXT_SCENARIO_SYSTEM, prompt, self.default_config)
+            if scenario is not None and self._is_valid_scenario(scenario):
+                self._scenario_cache[cache_key] = scenario
+                await self._shared_set(shared_key, scenario, 3600)
+                return copy.deepcopy(scenario)
             
-            response_text = response.choices[0].message.content.strip()
-            response_text = self._clean_json_response(response_text)
+            return None
             
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                analysis = json.loads(json_text)
-                
+        except Exception as e:
+            logger.error("Error generating next scenario: %s", e)
+            return None
+    
+    async def analyze_answer_with_death_check(self, scenario: Dict, player_answer: str, 
+                                            player_history: List[Dict]) -> Dict[str, Any]:
+        """Analyze player answer and determine if they should die instantly"""
+        
+        death_risk = scenario.get("death_risk_level", "medium")
+        previous_poor_choices = sum(1 for choice in player_history if choice.get("score", 50) < 30)
+        
+        if len(player_answer.split(None, MIN_ANALYSED_WORDS)) < MIN_ANALYSED_WORDS:
+            return self._fallback_death_analysis(player_answer, death_risk, previous_poor_choices)
+        
+        prompt = f"""CURRENT SCENARIO: {scenario.get("title", "")}
+SCENARIO DESCRIPTION: {scenario.get("description", "")[:400]}...
+DEATH RISK LEVEL: {death_risk}
+PLAYER'S PREVIOUS POOR CHOICES: {previous_poor_choices}
+
+SURVIVAL FACTORS BEING TESTED: {', '.join(scenario.get("survival_factors", []))}
+
+PLAYER'S CHOICE HISTORY:
+{orjson.dumps(player_history[-3:], option=orjson.OPT_SORT_KEYS).decode() if player_history else "No previous choices"}
+
+PLAYER RESPONSE: {player_answer}"""
+
+        cache_key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        shared_key = f"ai:analysis:{self.model}:{cache_key}"
+        cached = await self._shared_get(shared_key)
+        if cached is not None:
+            self._analysis_cache[cache_key] = cached
+            return copy.deepcopy(cached)
+        
+        embedding = None
+        if settings.semantic_cache_enabled:
+            context = [scenario.get("title", ""), scenario.get("description", "")[:400], death_risk, previous_poor_choices,
+                       scenario.get("survival_factors", []), player_history[-3:]]
+            context_key = hashlib.blake2b(orjson.dumps(context, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+            embedding = await self._embed(player_answer)
+            similar = self._similar_analysis(context_key, embedding)
+            if similar is not None:
+                return similar
+
+        try:
+            analysis = await self._call_json(ANALYSIS_SYSTEM, prompt, self.analysis_config)
+            if analysis is not None:
                 # Validate and ensure required fields
                 analysis["survival_score"] = max(0, min(100, analysis.get("survival_score", 50)))
                 analysis["instant_death"] = analysis.get("instant_death", False)
                 analysis["choice_classification"] = analysis.get("choice_classification", "neutral")
                 
-                return analysis
+                self._analysis_cache[cache_key] = analysis
+                await self._shared_set(shared_key, analysis, 24 * 3600)
+                if embedding is not None:
+                    self._remember_analysis(context_key, embedding, analysis)
+                return copy.deepcopy(analysis)
             
             raise Exception("Invalid JSON format")
             
         except Exception as e:
-            print(f"❌ Error analyzing answer: {e}")
+            logger.error("Error analyzing answer: %s", e)
             return self._fallback_death_analysis(player_answer, death_risk, previous_poor_choices)
     
-    async def generate_death_narrative(self, player_data: Dict, death_reason: str) -> Dict[str, Any]:
-        """Generate a dramatic death narrative for eliminated players"""
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Unit-length embedding of a player answer, or None if the embeddings call fails"""
+        try:
+            async with self._call_slots:
+                response = await self.client.embeddings.create(model=settings.embedding_model, input=text)
+        except Exception as e:
+            logger.error("Error embedding answer: %s", e)
+            return None
         
-        prompt = f"""You are a horror novelist creating a dramatic death scene for an eliminated player in "FrightFate: Who Dies First?".
-
-PLAYER: {player_data.get("player_name", "Unknown")}
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+    
+    def _similar_analysis(self, context_key: str, embedding: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+        entry = self._semantic_cache.get(context_key)
+        if entry is None or embedding is None:
+            return None
+        
+        vectors, analyses = entry
+        similarities = vectors @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < settings.semantic_cache_threshold:
+            return None
+        return copy.deepcopy(analyses[best])
+    
+    def _remember_analysis(self, context_key: str, embedding: np.ndarray, analysis: Dict[str, Any]) -> None:
+        vectors, analyses = self._semantic_cache.get(context_key, (np.empty((0, embedding.shape[0]), dtype=np.float32), []))
+        # Keep the newest entries once the context is full
+        self._semantic_cache[context_key] = (
+            np.vstack([vectors, embedding])[-SEMANTIC_CACHE_ENTRIES:],
+            (analyses + [analysis])[-SEMANTIC_CACHE_ENTRIES:]
+        )
+    
+    async def generate_death_narrative(self, player_data: Dict, death_reason: str) -> Optional[Dict[str, Any]]:
+        """Generate a dramatic death narrative for eliminated players; None if the model gives no usable one"""
+        
+        prompt = f"""PLAYER: {player_data.get("player_name", "Unknown")}
 CAUSE OF DEATH: {death_reason}
 TOTAL SCORE: {player_data.get("total_score", 0)}
-CHOICES MADE: {player_data.get("answer_count", 0)}
-
-Create a cinematic death narrative that:
-1. References their specific poor decisions
-2. Shows the consequences of their choices
-3. Is dramatic but not gratuitously graphic
-4. Explains why they died (recklessness, poor judgment, etc.)
-
-Return ONLY valid JSON:
-{{
-    "player_name": "{player_data.get('player_name', 'Unknown')}",
-    "eliminated": true,
-    "death_narrative": "Dramatic 2-3 sentence story of their demise",
-    "death_analysis": "1-2 sentences explaining why their choices led to death",
-    "fate_title": "💀 ELIMINATED",
-    "elimination_reason": "Brief reason for elimination"
-}}"""
+CHOICES MADE: {player_data.get("answer_count", 0)}"""
 
         try:
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a horror novelist creating elimination narratives. Return only valid JSON without any markdown formatting."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                **self.default_config
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            response_text = self._clean_json_response(response_text)
-            
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                return json.loads(json_text)
-            
-            return self._fallback_death_narrative(player_data, death_reason)
+            return await self._call_json(DEATH_NARRATIVE_SYSTEM, prompt, self.narrative_config)
             
         except Exception as e:
-            print(f"❌ Error generating death narrative: {e}")
-            return self._fallback_death_narrative(player_data, death_reason)
+            logger.error("Error generating death narrative: %s", e)
+            return None
     
     def _analyze_choice_pattern(self, player_choices: List[Dict]) -> str:
         """Analyze player's decision-making pattern"""
         if not player_choices:
             return "new_player"
         
-        avg_score = sum(choice.get("score", 50) for choice in player_choices) / len(player_choices)
-        poor_choices = sum(1 for choice in player_choices if choice.get("score", 50) < 30)
+        total_score = 0
+        poor_choices = 0
+        for choice in player_choices:
+            score = choice.get("score", 50)
+            total_score += score
+            if score < 30:
+                poor_choices += 1
+        avg_score = total_score / len(player_choices)
         
         if poor_choices >= 2:
             return "consistently_reckless"
@@ -342,13 +602,10 @@ Return ONLY valid JSON:
     
     def _fallback_death_analysis(self, answer: str, death_risk: str, previous_poor_choices: int) -> Dict[str, Any]:
         """Fallback analysis when AI fails"""
-        answer_lower = answer.lower()
-        
-        reckless_keywords = ["run", "charge", "attack", "rush", "fast", "immediately", "grab", "fight", "scream", "panic"]
-        cautious_keywords = ["carefully", "slowly", "quietly", "observe", "listen", "plan", "strategy", "safe", "caution"]
+        words = set(WORD_RE.findall(answer.lower()))
         
-        reckless_score = sum(10 for word in reckless_keywords if word in answer_lower)
-        cautious_score = sum(10 for word in cautious_keywords if word in answer_lower)
+        reckless_score = 10 * len(words & RECKLESS_KEYWORDS)
+        cautious_score = 10 * len(words & CAUTIOUS_KEYWORDS)
         
         base_score = 50 + cautious_score - reckless_score
         base_score = max(0, min(100, base_score))
@@ -385,81 +642,27 @@ Return ONLY valid JSON:
             "elimination_reason": death_reason or "Poor survival instincts"
         }
     
-    async def generate_final_results(self, players_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Generate final results using GitHub Models"""
+    async def generate_final_results(self, sorted_players: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Generate final results using GitHub Models for players in finishing order; None if the model gives no usable results"""
         
-        sorted_players = sorted(players_data, key=lambda x: x.get('total_score', 0), reverse=True)
+        player_count = len(sorted_players)
         
-        prompt = f"""You are a horror novelist creating the final results for "FrightFate: Who Dies First?" - a horror survival game.
-
-Players and their performance:
-{json.dumps(sorted_players, indent=2)}
-
-Rules:
-- Highest total_score survives (rank 1)
-- Others die in reverse score order (rank 2, 3, 4...)
-- Create dramatic, personalized narratives based on their decision-making patterns
-
-Return ONLY valid JSON array:
-[
-{{
-    "player_name": "PlayerName",
-    "rank": 1,
-    "survived": true,
-    "fate_title": "🎉 SOLE SURVIVOR",
-    "narrative": "Personalized 2-3 sentence story of how they survived/died based on their total score and decision patterns",
-    "survival_analysis": "1-2 sentences explaining WHY they survived/died based on their score"
-}}
-]
-
-IMPORTANT: Always include ALL required fields: player_name, rank, survived, fate_title, narrative, survival_analysis
-
-Make narratives:
-- Cinematic and dramatic
-- Specific to their performance (high scores = smart decisions, low scores = poor choices)
-- Horror-themed but not gratuitously graphic
-- Personalized, not generic
-
-Order by rank (survivor first, then deaths in order)."""
+        # Only what the narratives are based on, compactly, to keep the prompt small
+        performance = [
+            {field: player[field] for field in RESULTS_PROMPT_FIELDS if field in player}
+            for player in sorted_players
+        ]
+        prompt = f"""Players and their performance:
+{orjson.dumps(performance, option=orjson.OPT_SORT_KEYS).decode()}"""
 
         try:
-            # Results-specific config
-            results_config = {
-                "temperature": 0.8,
-                "max_tokens": 1500,
-                "top_p": 0.9,
-            }
-            
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a horror novelist creating final results. Return only valid JSON arrays without any markdown formatting. Always include ALL required fields."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                **results_config
-            )
-            
-            # Clean and parse response
-            response_text = response.choices[0].message.content.strip()
-            print(f"✅ Results response: {len(response_text)} characters")
-            
-            response_text = self._clean_json_response(response_text)
-            
-            # Find JSON array
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                results = json.loads(json_text)
-                
+            config = {**self.results_config, "max_tokens": min(RESULTS_MAX_TOKENS, RESULTS_TOKENS_PER_PLAYER * player_count)}
+            parsed = await self._call_json(RESULTS_SYSTEM, prompt, config)
+            results = parsed.get("results") if parsed is not None else None
+            if isinstance(results, list):
                 # Validate and ensure we have all required fields
                 validated_results = []
-                for result in results:
+                for result in islice(results, player_count):
                     # Ensure all required fields exist
                     validated_result = {
                         "player_name": result.get("player_name", "Unknown"),
@@ -471,43 +674,37 @@ Order by rank (survivor first, then deaths in order)."""
                     }
                     validated_results.append(validated_result)
                 
-                if len(validated_results) >= len(sorted_players):
-                    print(f"✅ Generated AI results for {len(validated_results)} players")
-                    return validated_results[:len(sorted_players)]
+                if len(validated_results) == player_count:
+                    logger.info("Generated AI results for %d players", player_count)
+                    return validated_results
             
             raise Exception("Invalid results format")
             
         except Exception as e:
-            print(f"❌ Error generating results with GitHub Models: {e}")
-            return self._fallback_results(sorted_players)
+            logger.error("Error generating results with GitHub Models: %s", e)
+            return None
     
     def _fallback_results(self, sorted_players: List[Dict]) -> List[Dict[str, Any]]:
         """Generate high-quality fallback results"""
         results = []
         
-        for i, player in enumerate(sorted_players):
-            rank = i + 1
-            survived = i == 0
+        for rank, player in enumerate(sorted_players, 1):
+            survived = rank == 1
+            total_score = player.get('total_score', 0)
             
             if survived:
-                narrative = "Your strategic thinking and careful decision-making kept you alive when others perished. Every choice you made showed wisdom and survival instinct."
                 fate_title = "🎉 SOLE SURVIVOR"
-                survival_analysis = f"With a total score of {player.get('total_score', 0)}, you demonstrated exceptional survival instincts and logical decision-making under pressure."
+                survival_analysis = f"With a total score of {total_score}, you demonstrated exceptional survival instincts and logical decision-making under pressure."
             else:
-                if rank == 2:
-                    narrative = f"You came close to survival, but a few critical mistakes cost you dearly. Your decision-making showed promise but lacked consistency when it mattered most."
-                else:
-                    narrative = f"Your impulsive decisions and poor risk assessment led to an early demise. In horror scenarios, hesitation and planning often mean the difference between life and death."
-                
                 fate_title = f"💀 VICTIM #{rank}"
-                survival_analysis = f"Your total score of {player.get('total_score', 0)} indicates {['poor', 'below average', 'average'][min(2, max(0, player.get('total_score', 0) // 30))]} decision-making under pressure."
+                survival_analysis = f"Your total score of {total_score} indicates {FALLBACK_SCORE_BANDS[min(2, max(0, total_score // 30))]} decision-making under pressure."
             
             results.append({
                 "player_name": player.get("player_name", "Unknown"),
                 "rank": rank,
                 "survived": survived,
                 "fate_title": fate_title,
-                "narrative": narrative,
+                "narrative": FALLBACK_NARRATIVES[min(rank, 3)],
                 "survival_analysis": survival_analysis
             })
         
@@ -515,35 +712,51 @@ Order by rank (survivor first, then deaths in order)."""
     
     def _get_fallback_initial_scenario(self, theme: str) -> Dict[str, Any]:
         """Fallback initial scenario"""
-        scenarios = {
-            "haunted_house": {
-                "question_number": 1,
-                "title": "The Inheritance",
-                "description": "You've inherited your great aunt's Victorian mansion. As you step inside for the first time, the heavy door slams shut behind you. The key that worked moments ago now refuses to turn. Through dusty windows, you see your car, but the door won't budge. The house feels unnaturally cold, and you hear slow footsteps on the wooden floors above, though you came here alone. What do you do?",
-                "survival_factors": ["logical_thinking", "caution", "investigation"],
-                "story_context": "Trapped in an inherited haunted mansion",
-                "branching_paths": [
-                    {"action_type": "cautious", "description": "Carefully investigate your surroundings"},
-                    {"action_type": "aggressive", "description": "Force your way out immediately"},
-                    {"action_type": "escape", "description": "Look for alternative exits"}
-                ]
-            }
-        }
+        scenario = FALLBACK_INITIAL_SCENARIOS.get(theme, FALLBACK_INITIAL_SCENARIOS[Theme.HAUNTED_HOUSE])
+        return copy.deepcopy(scenario)
+    
+    def _get_fallback_scenario(self, theme: str, question_number: int) -> Dict[str, Any]:
+        """Fallback scenario for any question; later questions get a fresh generic challenge"""
+        if question_number <= 1:
+            return self._get_fallback_initial_scenario(theme)
         
-        return scenarios.get(theme, scenarios["haunted_house"])
+        return {
+            "question_number": question_number,
+            "title": f"Challenge {question_number}",
+            "description": f"You face escalating danger in this {str(theme).replace('_', ' ')} scenario. What do you do?",
+            "survival_factors": ["logical_thinking", "caution"],
+            "death_risk_level": "medium"
+        }
+    
+    @staticmethod
+    def _is_valid_scenario(scenario: Dict[str, Any]) -> bool:
+        """Whether a generated scenario has what players are shown and answers are analysed against"""
+        title = scenario.get("title")
+        description = scenario.get("description")
+        return (
+            isinstance(title, str) and len(title) >= 3
+            and isinstance(description, str) and len(description) >= 50
+            and isinstance(scenario.get("survival_factors"), list)
+        )
     
-    # Keep existing methods for backwards compatibility
-    def _clean_json_response(self, response_text: str) -> str:
-        """Clean markdown and other formatting from JSON response"""
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        elif response_text.startswith('```'):
-            response_text = response_text[3:]
-        
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-        
-        return response_text.strip()
+    def _parse_json(self, response_text: str) -> Optional[Dict[str, Any]]:
+        """Parse a model reply as a JSON object, digging it out of surrounding text only if needed"""
+        try:
+            parsed = orjson.loads(response_text)
+            if isinstance(parsed, dict):
+                return parsed
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Replies fenced or wrapped in prose: decode one complete object from the first brace, ignoring what trails it
+        start = response_text.find("{")
+        if start == -1:
+            return None
+        try:
+            parsed, _ = json.JSONDecoder().raw_decode(response_text, start)
+        except ValueError:
+            return None
+        return parsed if parsed and isinstance(parsed, dict) else None
 
 # Global AI service instance
 ai_service = AIService()
\ No newline at end of file
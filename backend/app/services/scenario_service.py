@@ -0,0 +1,98 @@
+from typing import Dict, Any
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal
+from app.models.game import Scenario, Theme
+from app.services.ai_service import SCENARIO_PROMPT_VERSION, ai_service
+import asyncio
+import copy
+import logging
+
+logger = logging.getLogger("frightfate.scenarios")
+
+# Scenario fields that have their own columns; everything else lives in scoring_criteria
+SCENARIO_COLUMNS = ("question_number", "title", "description")
+
+# Loads in flight, one per theme, shared by every request, prefetch and warm-up that needs that theme;
+# holding the task also keeps it from being garbage collected
+_prefetches: Dict[str, asyncio.Task] = {}
+
+async def get_initial_scenario(theme: str) -> Dict[str, Any]:
+    """Opening scenario for a theme: in-process cache, then the scenarios table, then the LLM"""
+    cached = ai_service.cached_initial_scenario(theme)
+    if cached is not None:
+        return cached
+    
+    # Shielded so a caller's deadline doesn't cancel a load others are waiting on, or the row it is storing
+    return copy.deepcopy(await asyncio.shield(_initial_scenario_load(theme)))
+
+def _initial_scenario_load(theme: str) -> asyncio.Task:
+    task = _prefetches.get(theme)
+    if task is None:
+        task = asyncio.create_task(_load_initial_scenario(theme))
+        _prefetches[theme] = task
+        task.add_done_callback(lambda done: _finish_initial_scenario_load(theme, done))
+    return task
+
+def _finish_initial_scenario_load(theme: str, task: asyncio.Task) -> None:
+    _prefetches.pop(theme, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Error loading opening scenario for %s: %s", theme, task.exception())
+
+async def _fetch_initial_scenario(db: AsyncSession, theme: str) -> Dict[str, Any]:
+    stored = (await db.execute(
+        select(Scenario).where(
+            Scenario.theme == theme,
+            Scenario.question_number == 1,
+            Scenario.scoring_criteria["prompt_version"].as_integer() == SCENARIO_PROMPT_VERSION
+        ).order_by(Scenario.id).limit(1)
+    )).scalar_one_or_none()
+    
+    if stored:
+        scenario = {
+            "question_number": stored.question_number,
+            "title": stored.title,
+            "description": stored.description,
+            **{k: v for k, v in stored.scoring_criteria.items() if k != "prompt_version"}
+        }
+        ai_service.cache_initial_scenario(theme, scenario)
+        return scenario
+    
+    scenario = await ai_service.generate_initial_scenario(theme)
+    
+    # Only persist real generations; the AI service caches those but never its fallbacks
+    if ai_service.cached_initial_scenario(theme) is not None:
+        try:
+            db.add(Scenario(
+                theme=str(theme),
+                question_number=1,
+                title=scenario.get("title", ""),
+                description=scenario.get("description", ""),
+                scoring_criteria={
+                    **{k: v for k, v in scenario.items() if k not in SCENARIO_COLUMNS},
+                    "prompt_version": SCENARIO_PROMPT_VERSION
+                }
+            ))
+            await db.commit()
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error("Error storing opening scenario for %s: %s", theme, e)
+    
+    return scenario
+
+async def warm_initial_scenarios() -> None:
+    """Open the model connection, then load or generate the opening scenario for every known theme"""
+    await ai_service.warm_up()
+    for theme in Theme:
+        await get_initial_scenario(theme)
+
+async def _load_initial_scenario(theme: str) -> Dict[str, Any]:
+    # Its own session, since the load outlives whichever request started it
+    async with SessionLocal() as db:
+        return await _fetch_initial_scenario(db, theme)
+
+def prefetch_initial_scenario(theme: str) -> None:
+    """Start loading a theme's opening scenario in the background unless it is cached or already loading"""
+    if ai_service.cached_initial_scenario(theme) is None:
+        _initial_scenario_load(theme)
\ No newline at end of file
@@ -0,0 +1,40 @@
+-- Brings a database created before the elimination columns, the per-question unique
+-- constraint and the composite indexes up to the current models. create_all only
+-- creates missing tables, so run this once against existing databases:
+--
+--     psql "$DATABASE_URL" -f backend/sql/001_player_answers_elimination_and_indexes.sql
+--
+-- Every statement is idempotent, so running it again is harmless.
+
+BEGIN;
+
+-- Elimination is stored on the answer that caused it
+ALTER TABLE player_answers ADD COLUMN IF NOT EXISTS is_eliminated BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE player_answers ADD COLUMN IF NOT EXISTS elimination_reason TEXT;
+
+-- Keep only the latest answer per player and question so the unique constraint can be added
+DELETE FROM player_answers pa
+USING player_answers newer
+WHERE newer.session_id = pa.session_id
+  AND newer.player_id = pa.player_id
+  AND newer.question_number = pa.question_number
+  AND newer.id > pa.id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_pa_session_player_q') THEN
+        ALTER TABLE player_answers
+            ADD CONSTRAINT uq_pa_session_player_q UNIQUE (session_id, player_id, question_number);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS ix_pa_player_qnum ON player_answers (player_id, question_number);
+CREATE INDEX IF NOT EXISTS ix_pa_player_latest ON player_answers (player_id, id);
+CREATE INDEX IF NOT EXISTS ix_pa_player_eliminated ON player_answers (player_id, is_eliminated);
+CREATE INDEX IF NOT EXISTS ix_players_session_name ON players (session_id, name);
+CREATE INDEX IF NOT EXISTS ix_scenarios_theme_qnum ON scenarios (theme, question_number);
+
+-- The primary key already indexes id
+DROP INDEX IF EXISTS ix_player_answers_id;
+
+COMMIT;
@@ -777,7 +777,8 @@ async function submitAnswer() {
         session_code: gameState.sessionCode,
         player_id: gameState.playerId,
         question_number: gameState.currentQuestion,
-        answer_text: answer
+        answer_text: answer,
+        scenario_id: gameState.scenarios[gameState.currentQuestion - 1]?.scenario_id
       })
     });
     
@@ -805,6 +806,7 @@ async function submitRushedAnswer(answer) {
         player_id: gameState.playerId,
         question_number: gameState.currentQuestion,
         answer_text: answer,
+        scenario_id: gameState.scenarios[gameState.currentQuestion - 1]?.scenario_id,
         is_rushed: true
       })
     });